@@ -2,8 +2,33 @@ from TypeCheckerParser import TypeCheckerParser as ExprParser
 from TypeCheckerVisitor import TypeCheckerVisitor as ExprVisitor
 from collections import defaultdict
 
+# Builtin type names
+CHUNK = "chunk"
+FRACTION = "fraction"
+STRING = "string"
+NONE = "none"
+
+# Result type of mixing numeric operand types in arithmetic expressions
+NUMERIC_PROMOTIONS = {
+    (CHUNK, FRACTION): FRACTION,
+    (FRACTION, CHUNK): FRACTION,
+}
+
+# Operand types that cannot be combined even with themselves
+ADDITIVE_INVALID_TYPES = frozenset({NONE})
+MULTIPLICATIVE_INVALID_TYPES = frozenset({NONE, STRING})
+
 
 class SymbolTable:
+    __slots__ = (
+        "global_scope",
+        "class_scopes",
+        "method_scopes",
+        "class_info",
+        "method_info",
+        "scope_stack",
+    )
+
     def __init__(self):
         self.global_scope = defaultdict(lambda: defaultdict(lambda: dict))
         self.class_scopes = defaultdict(
@@ -12,6 +37,8 @@ class SymbolTable:
         self.method_scopes = defaultdict(
             lambda: defaultdict(lambda: defaultdict(lambda: dict))
         )  # Track method scopes
+        self.class_info = {}  # Track class details (line, template flag, superclass)
+        self.method_info = {}  # Track method details (return type, line, owner class)
         self.scope_stack = []  # Track the current scope stack
 
     def enter_scope(self, class_name=None, method_name=None):
@@ -81,12 +108,15 @@ class SymbolTable:
     def add_class(self, class_name, line, is_template):
         """Add class to the symbol table"""
         self.class_scopes[class_name] = defaultdict(dict)
-        self.class_scopes[class_name]["line"] = line
-        self.class_scopes[class_name]["is_template"] = is_template
+        self.class_info[class_name] = {
+            "line": line,
+            "is_template": is_template,
+            "superclass": None,
+        }
 
     def add_method(self, method_name, return_type, line, class_name=None):
         """Add method to the symbol table"""
-        method_info = defaultdict(dict)
+        method_info = {}
         method_info["return_type"] = return_type
         method_info["line"] = line
 
@@ -102,7 +132,8 @@ class SymbolTable:
             method_name = f"{self.current_scope()[0]}.{method_name}"
             method_info["from_class"] = self.current_scope()[0]
 
-        self.method_scopes[method_name] = method_info
+        self.method_scopes[method_name] = defaultdict(dict)
+        self.method_info[method_name] = method_info
 
     def get_current_class(self):
         """Get the current class name"""
@@ -114,6 +145,10 @@ class SymbolTable:
         """Get the class by name"""
         return self.class_scopes[class_name]
 
+    def get_class_info(self, class_name):
+        """Get the class details by name, None if the class is not declared"""
+        return self.class_info.get(class_name)
+
     def get_current_method(self):
         """Get the current method name"""
         class_name, method_name = self.current_scope()
@@ -122,10 +157,20 @@ class SymbolTable:
         return self.get_method(class_name, method_name)
 
     def get_method(self, class_name, method_name):
-        """Get the method by name"""
-        if class_name is not None:
-            return self.method_scopes[f"{class_name}.{method_name}"]
-        return self.method_scopes[method_name]
+        """Get the method details by name (searching superclasses), None if not declared"""
+        if class_name is None:
+            return self.method_info.get(method_name)
+
+        # Stop on a repeated class so cyclic inheritance cannot loop forever
+        seen = set()
+        while class_name is not None and class_name not in seen:
+            method_info = self.method_info.get(f"{class_name}.{method_name}")
+            if method_info is not None:
+                return method_info
+            seen.add(class_name)
+            class_info = self.class_info.get(class_name)
+            class_name = class_info["superclass"] if class_info else None
+        return None
 
     # end add class and method to symbol table
 
@@ -198,40 +243,31 @@ class SymbolTable:
         return False
 
     def items(self):
-        vars = {}
-        for var_name, var_info in self.global_scope.items():
-            if var_name.startswith("$"):
-                vars[var_name] = var_info
-        for cls in self.class_scopes.values():
-            if cls["is_template"]:
+        vars = dict(self.global_scope)
+        for class_name, class_info in self.class_info.items():
+            if class_info["is_template"]:
                 continue
-            for var_name, var_info in cls.items():
-                if var_name.startswith("$"):
-                    vars[var_name] = var_info
+            vars.update(self.class_scopes[class_name])
         for method in self.method_scopes.values():
-            for var_name, var_info in method.items():
-                if var_name.startswith("$"):
-                    vars[var_name] = var_info
+            vars.update(method)
         return vars.items()
 
     def __str__(self):
-        return f"Global scope: {self.global_scope}\nClass scopes: {self.class_scopes}\nMethod scopes: {self.method_scopes}\nCurrent scope: {self.current_scope()}"
+        return f"Global scope: {self.global_scope}\nClass scopes: {self.class_scopes}\nMethod scopes: {self.method_scopes}\nClass info: {self.class_info}\nMethod info: {self.method_info}\nCurrent scope: {self.current_scope()}"
 
 
 class TypeChecker(ExprVisitor):
     def __init__(self):
         self.symbol_table = SymbolTable()  # Tracks variable names and their types
         self.used_variables = set()  # Tracks variables that are used
-
-    def markVariableAsUsed(self, var_name):
-        """Helper function to mark variables as used."""
-        self.used_variables.add(var_name)
+        self._ancestors = {}  # Caches each type with all of its superclasses
 
     def get_line_info(self, ctx):
         """Helper function to get the line number and position from the context."""
-        line = ctx.start.line if ctx.start else None  # Get line number
-        col = ctx.start.column if ctx.start else None  # Get column number
-        return line, col
+        start = ctx.start
+        if start is None:
+            return None, None
+        return start.line, start.column  # Get line number and column number
 
     def is_type_compatible(self, declared_type, expr_type):
         # If both types are the same, it's compatible
@@ -240,17 +276,40 @@ class TypeChecker(ExprVisitor):
 
         # Check if the declared type is a superclass of the assigned type
         if declared_type in self.symbol_table.class_scopes:
-            current_type = expr_type
-            while current_type is not None:
-                if current_type == declared_type:
-                    return True
-                current_type = self.symbol_table.get_class(current_type).get(
-                    "superclass", None
-                )
+            return declared_type in self.get_ancestors(expr_type)
 
         # If not compatible, return False
         return False
 
+    def get_ancestors(self, type_name):
+        """Helper function to get a type and all of its superclasses."""
+        ancestors = self._ancestors.get(type_name)
+        if ancestors is not None:
+            return ancestors
+
+        # Walk up until a type with known ancestors, collecting the chain
+        chain = []
+        seen = set()
+        current_type = type_name
+        while current_type is not None and current_type not in self._ancestors:
+            # A repeated type means cyclic inheritance, raise before anything
+            # on the chain is cached so no partial closure is ever stored
+            if current_type in seen:
+                raise Exception(
+                    f"Cyclic inheritance involving class '{current_type}'."
+                )
+            seen.add(current_type)
+            chain.append(current_type)
+            class_info = self.symbol_table.get_class_info(current_type)
+            current_type = class_info["superclass"] if class_info else None
+
+        # Fill the chain top-down so every class on it is resolved at once
+        ancestors = self._ancestors.get(current_type, frozenset())
+        for chain_type in reversed(chain):
+            ancestors = ancestors | {chain_type}
+            self._ancestors[chain_type] = ancestors
+        return ancestors
+
     def visitProgram(self, ctx: ExprParser.ProgramContext):
         # Visit all statements in the program
         for statement in ctx.statement():
@@ -269,11 +328,9 @@ class TypeChecker(ExprVisitor):
         # Evaluate the expression
         expr_type = self.visit(ctx.expression())
 
-        # Get the line and column for better error messages
-        line, col = self.get_line_info(ctx)
-
         # Validate the type
-        if expr_type == "none":
+        if expr_type == NONE:
+            line, col = self.get_line_info(ctx)
             raise Exception(f"Cannot show a 'none' value at line {line}, column {col}.")
 
         # Print the evaluated value (as a placeholder for actual execution)
@@ -287,24 +344,23 @@ class TypeChecker(ExprVisitor):
         var_name = var_signature.variableName().getText()
         var_type = var_signature.type_().getText()  # The declared type of the variable
 
-        # Get line number for better error messages
-        line, col = self.get_line_info(ctx)
-
         # Check for redeclaration of the variable
         if var_name in self.symbol_table:
             raise Exception(f"Variable '{var_name}' already declared.")
 
         # Add the variable to the symbol table with its declared type and the line number
-        self.symbol_table.add_to_scope(var_name, var_type, line)
+        self.symbol_table.add_to_scope(var_name, var_type, ctx.start.line)
 
-        # Check the initializer expression for type mismatch
-        initializer = (
-            ctx.expression() or ctx.createClassStatement()
-        )  # Check if there's an initializer expression
+        # Check the initializer expression for type mismatch, falling back to
+        # a class creation only when there is no plain expression
+        initializer = ctx.expression()
+        if initializer is None:
+            initializer = ctx.createClassStatement()
 
-        if initializer:
+        if initializer is not None:
             init_type = self.visit(initializer)  # Visit the initializer to get its type
             if not self.is_type_compatible(var_type, init_type):
+                line, col = self.get_line_info(ctx)
                 raise Exception(
                     f"Type mismatch: Cannot assign {init_type} to {var_type} for variable '{var_name}' at line {line}, column {col}."
                 )
@@ -313,11 +369,10 @@ class TypeChecker(ExprVisitor):
         # Extract the variable name from the assignment
         var_name = ctx.variableName().getText()
 
-        # Get line number for better error messages
-        line, col = self.get_line_info(ctx)
-
-        # Check if the variable has been declared
-        if var_name not in self.symbol_table:
+        # Get the type of the variable from the symbol table, None if not declared
+        declared_type = self.symbol_table.get_var_type(var_name)
+        if declared_type is None:
+            line, col = self.get_line_info(ctx)
             raise Exception(
                 f"Variable '{var_name}' not declared at line {line}, column {col}."
             )
@@ -325,14 +380,15 @@ class TypeChecker(ExprVisitor):
         # Mark the variable as used
         self.used_variables.add(var_name)
 
-        # Get the type of the variable from the symbol table
-        declared_type = self.symbol_table.get_var_type(var_name)
-
-        # Visit the assigned expression to determine its type
-        expr_type = self.visit(ctx.expression())
+        # Visit the assigned expression (or class creation) to determine its type
+        value = ctx.expression()
+        if value is None:
+            value = ctx.createClassStatement()
+        expr_type = self.visit(value)
 
         # Check for type compatibility: if declared type is a class type, check inheritance
         if not self.is_type_compatible(declared_type, expr_type):
+            line, col = self.get_line_info(ctx)
             raise Exception(
                 f"Type mismatch: Cannot assign {expr_type} to {declared_type} for variable '{var_name}' at line {line}, column {col}."
             )
@@ -341,9 +397,10 @@ class TypeChecker(ExprVisitor):
 
     def visitMethodDeclaration(self, ctx: ExprParser.MethodDeclarationContext):
         # Handle method signature (method_name, type, parameters)
-        method_name = ctx.methodSignature().methodName().getText()
-        return_type = ctx.methodSignature().type_().getText()
-        parameters = ctx.methodSignature().parametersInit()
+        method_signature = ctx.methodSignature()
+        method_name = method_signature.methodName().getText()
+        return_type = method_signature.type_().getText()
+        parameters = method_signature.parametersInit()
 
         if self.symbol_table.has_method_in_scope(method_name):
             line, col = self.get_line_info(ctx)
@@ -352,7 +409,8 @@ class TypeChecker(ExprVisitor):
             )
 
         # Add method to the symbol table, including its return type
-        self.symbol_table.add_method(method_name, return_type, ctx.start.line)
+        line = ctx.start.line
+        self.symbol_table.add_method(method_name, return_type, line)
 
         # Enter method scope to add variables to correct scope
         self.symbol_table.enter_scope(method_name=method_name)
@@ -362,14 +420,17 @@ class TypeChecker(ExprVisitor):
             parameters.type_(), parameters.variableName()
         ):
             self.symbol_table.add_to_scope(
-                param_name.getText(), param_type.getText(), ctx.start.line
+                param_name.getText(), param_type.getText(), line
             )
 
-        # Now handle method block (statements inside method)
-        self.visit(ctx.methodBlock())
+        # Now handle method block (statements inside method), the return
+        # statement is checked below so its expression is only visited once
+        method_block = ctx.methodBlock()
+        for statement in method_block.statement():
+            self.visit(statement)
 
         # Handle return statement type validation
-        return_statement = ctx.methodBlock().returnStatement()
+        return_statement = method_block.returnStatement()
         if return_statement:
             return_expr_type = self.visit(return_statement.expression())
             if return_expr_type != return_type:
@@ -382,10 +443,11 @@ class TypeChecker(ExprVisitor):
 
     def visitClassDeclaration(self, ctx: ExprParser.ClassDeclarationContext):
         # Handle class name and inheritance
-        class_name = ctx.className()[0].getText()
+        class_names = ctx.className()
+        class_name = class_names[0].getText()
         superclass_name = None
-        if len(ctx.className()) > 1:
-            superclass_name = ctx.className()[1].getText()
+        if len(class_names) > 1:
+            superclass_name = class_names[1].getText()
 
         # Check if the class already exists in the symbol table
         if class_name in self.symbol_table.class_scopes:
@@ -399,7 +461,10 @@ class TypeChecker(ExprVisitor):
 
         self.symbol_table.enter_scope(class_name=class_name)
 
-        self.symbol_table.get_current_class()["superclass"] = superclass_name
+        self.symbol_table.get_class_info(class_name)["superclass"] = superclass_name
+
+        # Class hierarchy changed, drop cached ancestors
+        self._ancestors.clear()
 
         # Add class fields (variables)
         for field in ctx.variableSignature():
@@ -427,82 +492,81 @@ class TypeChecker(ExprVisitor):
 
     def visitExpression(self, ctx: ExprParser.ExpressionContext):
         # Delegate to additiveExpression, as it's the core of the expression
-        return self.visit(ctx.additiveExpression())
-
-    def visitAdditiveExpression(self, ctx: ExprParser.AdditiveExpressionContext):
-        # If there is only one multiplicative expression, return its value
-        if len(ctx.multiplicativeExpression()) == 1:
-            return self.visit(ctx.multiplicativeExpression(0))
+        additive_expression = ctx.additiveExpression()
+        operands = additive_expression.multiplicativeExpression()
+        if len(operands) > 1:
+            return self.visitAdditiveExpression(additive_expression)
 
-        # Handle compound expressions (e.g., x + y)
-        left_type = self.visit(ctx.multiplicativeExpression(0))
-        for i in range(1, len(ctx.multiplicativeExpression())):
-            right_type = self.visit(ctx.multiplicativeExpression(i))
-
-            # Prevent addition of string with non-string
-            if (left_type == "string" and right_type != "string") or (
-                left_type != "string" and right_type == "string"
-            ):
-                line, col = self.get_line_info(ctx)
-                raise Exception(
-                    f"Type mismatch in additive expression at line {line}, column {col}: cannot add {left_type} and {right_type}."
-                )
+        # A single operand is a multiplicativeExpression, walk down into it
+        multiplicative_expression = operands[0]
+        terms = multiplicative_expression.term()
+        if len(terms) > 1:
+            return self.visitMultiplicativeExpression(multiplicative_expression)
 
-            # Allow implicit conversion: if one is 'chunk' and the other is 'fraction', promote 'chunk' to 'fraction'
-            if left_type == "chunk" and right_type == "fraction":
-                left_type = "fraction"
-            elif left_type == "fraction" and right_type == "chunk":
-                right_type = "fraction"
+        # A single term needs no operand checks at all
+        return self.visit(terms[0])
 
-            if left_type != right_type or left_type == "none" or right_type == "none":
-                line, col = self.get_line_info(ctx)
-                raise Exception(
-                    f"Type mismatch in additive expression at line {line}, column {col}: {left_type} and {right_type} are not the same."
-                )
-        return left_type  # Assume type consistency
+    def visitAdditiveExpression(self, ctx: ExprParser.AdditiveExpressionContext):
+        # Handle compound expressions (e.g., x + y)
+        return self.check_operand_types(
+            ctx,
+            ctx.multiplicativeExpression(),
+            "additive",
+            ADDITIVE_INVALID_TYPES,
+            string_mix_error="cannot add {} and {}.",  # Prevent addition of string with non-string
+        )
 
     def visitMultiplicativeExpression(
         self, ctx: ExprParser.MultiplicativeExpressionContext
     ):
-        # If there is only one term, return its value
-        if len(ctx.term()) == 1:
-            return self.visit(ctx.term(0))
-
         # Handle compound expressions (e.g., x * y)
-        left_type = self.visit(ctx.term(0))
-        for i in range(1, len(ctx.term())):
-            right_type = self.visit(ctx.term(i))
+        return self.check_operand_types(
+            ctx, ctx.term(), "multiplicative", MULTIPLICATIVE_INVALID_TYPES
+        )
 
-            # Allow implicit conversion: if one is 'chunk' and the other is 'fraction', promote 'chunk' to 'fraction'
-            if left_type == "chunk" and right_type == "fraction":
-                left_type = "fraction"
-            elif left_type == "fraction" and right_type == "chunk":
-                right_type = "fraction"
+    def check_operand_types(
+        self, ctx, operands, kind, invalid_types, string_mix_error=None
+    ):
+        """Helper function to fold the operand types of a binary expression chain."""
+        left_type = self.visit(operands[0])
+        for operand in operands[1:]:
+            right_type = self.visit(operand)
 
-            if (
-                left_type != right_type
-                or left_type == "none"
-                or right_type == "none"
-                or left_type == "string"
-                or right_type == "string"
-            ):
+            # Same operand types keep their type unless the operator rejects it
+            if left_type == right_type and left_type not in invalid_types:
+                continue
+
+            # Allow implicit conversion: if one is 'chunk' and the other is 'fraction', promote 'chunk' to 'fraction'
+            promoted_type = NUMERIC_PROMOTIONS.get((left_type, right_type))
+            if promoted_type is None:
                 line, col = self.get_line_info(ctx)
+
+                # Operators can give their own detail for a string mixed with a non-string
+                if string_mix_error and (left_type == STRING) != (
+                    right_type == STRING
+                ):
+                    detail = string_mix_error.format(left_type, right_type)
+                else:
+                    detail = f"{left_type} and {right_type} are not the same."
                 raise Exception(
-                    f"Type mismatch in multiplicative expression at line {line}, column {col}: {left_type} and {right_type} are not the same."
+                    f"Type mismatch in {kind} expression at line {line}, column {col}: {detail}"
                 )
+            left_type = promoted_type
         return left_type  # Assume type consistency
 
     def visitTerm(self, ctx: ExprParser.TermContext):
         # Check if the term is a variableName
-        if ctx.variableName():
-            var_name = ctx.variableName().getText()
-            if var_name not in self.symbol_table:
+        variable_name = ctx.variableName()
+        if variable_name:
+            var_name = variable_name.getText()
+            var_type = self.symbol_table.get_var_type(var_name)
+            if var_type is None:
                 line, col = self.get_line_info(ctx)
                 raise Exception(
                     f"Variable '{var_name}' not declared at line {line}, column {col}."
                 )
-            self.markVariableAsUsed(var_name)
-            return self.symbol_table.get_var_type(var_name)
+            self.used_variables.add(var_name)
+            return var_type
 
         # Check if the term is a literal
         elif ctx.literal():
@@ -525,11 +589,11 @@ class TypeChecker(ExprVisitor):
     def visitLiteral(self, ctx: ExprParser.LiteralContext):
         # Check if it's a chunkLiteral, fractionLiteral, or stringLiteral
         if ctx.ChunkLiteral():
-            return "chunk"  # Return the type for chunk literal
+            return CHUNK  # Return the type for chunk literal
         elif ctx.FractionLiteral():
-            return "fraction"  # Return the type for fraction literal
+            return FRACTION  # Return the type for fraction literal
         elif ctx.StringLiteral():
-            return "string"  # Return the type for string literal
+            return STRING  # Return the type for string literal
         else:
             raise Exception(f"Unsupported literal: {ctx.getText()}")
 
@@ -554,15 +618,16 @@ class TypeChecker(ExprVisitor):
 
         # try to find class
         class_name = None
-        if ctx.variableName():
-            var_name = ctx.variableName().getText()
-            if var_name not in self.symbol_table:
+        variable_name = ctx.variableName()
+        if variable_name:
+            var_name = variable_name.getText()
+            class_name = self.symbol_table.get_var_type(var_name)
+            if class_name is None:
                 line, col = self.get_line_info(ctx)
                 raise Exception(
                     f"Variable '{var_name}' not declared at line {line}, column {col}."
                 )
-            self.markVariableAsUsed(var_name)
-            class_name = self.symbol_table.get_var_type(var_name)
+            self.used_variables.add(var_name)
         elif ctx.className():
             class_name = ctx.className().getText()
 
@@ -572,23 +637,31 @@ class TypeChecker(ExprVisitor):
                 f"Class '{class_name}' not declared at line {line}, column {col}."
             )
 
+        method_info = self.symbol_table.get_method(class_name, method_name)
+        if method_info is None:
+            line, col = self.get_line_info(ctx)
+            raise Exception(
+                f"Method '{method_name}' not declared at line {line}, column {col}."
+            )
+
         for variable in ctx.parametersCall().expression():
             resolved_variable = self.visit(variable)
 
-        return self.symbol_table.get_method(class_name, method_name)["return_type"]
+        return method_info["return_type"]
 
     def visitClassVariableAccess(self, ctx: ExprParser.ClassVariableAccessContext):
         access_name = ctx.accessedVariableName().getText()
 
-        if ctx.variableName():
-            var_name = ctx.variableName().getText()
-            if var_name not in self.symbol_table:
+        variable_name = ctx.variableName()
+        if variable_name:
+            var_name = variable_name.getText()
+            class_name = self.symbol_table.get_var_type(var_name)
+            if class_name is None:
                 line, col = self.get_line_info(ctx)
                 raise Exception(
                     f"Variable '{var_name}' not declared at line {line}, column {col}."
                 )
-            self.markVariableAsUsed(var_name)
-            class_name = self.symbol_table.get_var_type(var_name)
+            self.used_variables.add(var_name)
         elif ctx.className():
             class_name = ctx.className().getText()
 
@@ -615,6 +688,9 @@ class TypeChecker(ExprVisitor):
 
         self.symbol_table.enter_scope(class_name=template_name)
 
+        # Class hierarchy changed, drop cached ancestors
+        self._ancestors.clear()
+
         # Add class fields (variables)
         for field in ctx.variableSignature():
             # Initialize var_type to None before the try block
@@ -649,7 +725,8 @@ class TypeChecker(ExprVisitor):
             )
 
         # Add method to the symbol table, including its return type
-        self.symbol_table.add_method(method_name, return_type, ctx.start.line)
+        line = ctx.start.line
+        self.symbol_table.add_method(method_name, return_type, line)
 
         # Enter method scope to add variables to correct scope
         self.symbol_table.enter_scope(method_name=method_name)
@@ -659,7 +736,7 @@ class TypeChecker(ExprVisitor):
             parameters.type_(), parameters.variableName()
         ):
             self.symbol_table.add_to_scope(
-                param_name.getText(), param_type.getText(), ctx.start.line
+                param_name.getText(), param_type.getText(), line
             )
 
         self.symbol_table.exit_scope()